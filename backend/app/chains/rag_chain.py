@@ -2,35 +2,41 @@
 RAG Chain
 - Conversational memory (per session)
 - Hybrid retrieval
-- Gemini chat model for answer generation
+- Gemini chat model for answer generation (blocking or streamed)
 - Source citations
 """
+import threading
+from collections import deque
 from functools import lru_cache
+from typing import Iterator
 
+from cachetools import LRUCache
 from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.memory import ConversationBufferWindowMemory
-from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain.schema import AIMessage, BaseMessage, HumanMessage, SystemMessage
 
 from app.core.config import get_settings
 from app.retrieval.hybrid_retriever import hybrid_retrieve
 
 settings = get_settings()
 
-_session_memories: dict[str, ConversationBufferWindowMemory] = {}
+# Each session keeps its last MEMORY_TURNS question/answer pairs.
+# Least recently used sessions are evicted once MAX_SESSIONS is reached.
+_session_memories: LRUCache = LRUCache(maxsize=settings.MAX_SESSIONS)
+_session_lock = threading.Lock()
 
 
-def get_memory(session_id: str) -> ConversationBufferWindowMemory:
-    if session_id not in _session_memories:
-        _session_memories[session_id] = ConversationBufferWindowMemory(
-            k=6,
-            return_messages=True,
-            memory_key="chat_history",
-        )
-    return _session_memories[session_id]
+def get_memory(session_id: str) -> deque[BaseMessage]:
+    with _session_lock:
+        memory = _session_memories.get(session_id)
+        if memory is None:
+            memory = deque(maxlen=2 * settings.MEMORY_TURNS)
+            _session_memories[session_id] = memory
+        return memory
 
 
 def clear_memory(session_id: str) -> None:
-    _session_memories.pop(session_id, None)
+    with _session_lock:
+        _session_memories.pop(session_id, None)
 
 
 @lru_cache()
@@ -73,11 +79,9 @@ def get_llm() -> ChatGoogleGenerativeAI:
     )
 
 
-RAG_PROMPT = ChatPromptTemplate.from_messages(
-    [
-        (
-            "system",
-            """You are EnterpriseRAG, an expert assistant for internal company documents.
+# Filled with str.format and sent as a plain message list, which skips
+# ChatPromptTemplate's per-call template parsing and validation.
+SYSTEM_TEMPLATE = """You are EnterpriseRAG, an expert assistant for internal company documents.
 
 Answer the user's question using ONLY the context provided below.
 Rules:
@@ -89,55 +93,91 @@ Rules:
 
 CONTEXT:
 {context}
-""",
-        ),
-        MessagesPlaceholder(variable_name="chat_history"),
-        ("human", "{question}"),
-    ]
-)
+"""
 
 
 def format_context(docs) -> str:
-    parts = []
+    # Each chunk is capped so prompt size (and Gemini latency) stays bounded.
+    limit = settings.MAX_CONTEXT_CHARS_PER_DOC
+    return "\n\n---\n\n".join(
+        f"[Source: {meta.get('source', 'unknown')} | Page: {meta.get('page', '?')}]\n"
+        f"{doc.page_content[:limit]}"
+        for doc in docs
+        for meta in (doc.metadata,)
+    )
+
+
+def format_sources(docs) -> list[dict]:
+    """One citation per distinct (source, page), in retrieval order."""
+    seen: dict[tuple, dict] = {}
     for doc in docs:
         src = doc.metadata.get("source", "unknown")
         page = doc.metadata.get("page", "?")
-        parts.append(f"[Source: {src} | Page: {page}]\n{doc.page_content}")
-    return "\n\n---\n\n".join(parts)
+        seen.setdefault((src, page), {"filename": src, "page": page})
+    return list(seen.values())
+
+
+def build_messages(question: str, history, docs) -> list[BaseMessage]:
+    return [
+        SystemMessage(content=SYSTEM_TEMPLATE.format(context=format_context(docs))),
+        *history,
+        HumanMessage(content=question),
+    ]
 
 
-def query_rag(question: str, session_id: str) -> dict:
+def query_rag(question: str, session_id: str, include_contexts: bool = False) -> dict:
+    """
+    Answer a question with hybrid retrieval + Gemini.
+    With include_contexts, the retrieved chunk texts are returned as
+    "contexts" so callers don't have to retrieve a second time.
+    """
     memory = get_memory(session_id)
     llm = get_llm()
 
     retrieved_docs = hybrid_retrieve(question)
-    context = format_context(retrieved_docs)
+    messages = build_messages(question, memory, retrieved_docs)
 
-    chat_history = memory.chat_memory.messages
-    prompt_value = RAG_PROMPT.format_messages(
-        context=context,
-        chat_history=chat_history,
-        question=question,
-    )
-
-    response = llm.invoke(prompt_value)
+    response = llm.invoke(messages)
     answer = response.content
 
-    memory.chat_memory.add_user_message(question)
-    memory.chat_memory.add_ai_message(answer)
-
-    sources = []
-    seen = set()
-    for doc in retrieved_docs:
-        src = doc.metadata.get("source", "unknown")
-        page = doc.metadata.get("page", "?")
-        key = f"{src}:{page}"
-        if key not in seen:
-            seen.add(key)
-            sources.append({"filename": src, "page": page})
+    memory.append(HumanMessage(content=question))
+    memory.append(AIMessage(content=answer))
 
-    return {
+    result = {
         "answer": answer,
-        "sources": sources,
+        "sources": format_sources(retrieved_docs),
         "session_id": session_id,
-    }
\ No newline at end of file
+    }
+    if include_contexts:
+        # The text the model actually saw, so evaluation scores match it
+        limit = settings.MAX_CONTEXT_CHARS_PER_DOC
+        result["contexts"] = [doc.page_content[:limit] for doc in retrieved_docs]
+    return result
+
+
+def stream_rag(question: str, session_id: str) -> Iterator[dict]:
+    """
+    Same as query_rag, but returns an iterator of {"delta": text} events as
+    Gemini generates and a final {"sources", "session_id"} event.
+    Memory, model, retrieval and prompt are resolved when this is called, so
+    their errors raise here; only generation happens during iteration. The
+    exchange is added to memory only once the answer has been fully generated.
+    """
+    memory = get_memory(session_id)
+    llm = get_llm()
+
+    retrieved_docs = hybrid_retrieve(question)
+    messages = build_messages(question, memory, retrieved_docs)
+
+    def events() -> Iterator[dict]:
+        parts = []
+        for chunk in llm.stream(messages):
+            parts.append(chunk.content)
+            yield {"delta": chunk.content}
+
+        memory.append(HumanMessage(content=question))
+        memory.append(AIMessage(content="".join(parts)))
+
+        yield {"sources": format_sources(retrieved_docs), "session_id": session_id}
+
+    return events()
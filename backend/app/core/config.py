@@ -16,10 +16,30 @@ class Settings(BaseSettings):
     CHUNK_SIZE: int = 1000
     CHUNK_OVERLAP: int = 200
 
+    # Embedding
+    EMBED_BATCH_SIZE: int = 100   # texts per embedding request
+    EMBED_CONCURRENCY: int = 4    # embedding requests in flight during ingest
+    # Empty = <CHROMA_PERSIST_DIR>/emb_cache, so it lives on the same volume
+    EMBEDDING_CACHE_DIR: str = ""
+
     # Retrieval
     TOP_K_DENSE: int = 5
     TOP_K_SPARSE: int = 5
     TOP_K_FINAL: int = 4          # after re-ranking
+    # Chroma distance below which the top dense hit is returned without BM25.
+    # The collection uses squared L2; for unit-norm embeddings that is
+    # 2 - 2*cos, so 0.3 ~ cosine similarity 0.85. Set to 0 to always fuse.
+    DENSE_CONF_THRESHOLD: float = 0.3
+    RETRIEVAL_CACHE_SIZE: int = 1024  # cached query results
+    RETRIEVAL_CACHE_TTL: int = 300    # seconds
+    # Characters of each retrieved chunk sent to the LLM. Below CHUNK_SIZE so
+    # prompt context is bounded at TOP_K_FINAL * this; raise it to CHUNK_SIZE
+    # to send whole chunks.
+    MAX_CONTEXT_CHARS_PER_DOC: int = 800
+
+    # Chat memory
+    MAX_SESSIONS: int = 10_000    # least recently used sessions are evicted
+    MEMORY_TURNS: int = 6         # question/answer pairs kept per session
 
     # ChromaDB
     CHROMA_PERSIST_DIR: str = "./chroma_db"
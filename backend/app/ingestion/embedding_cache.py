@@ -0,0 +1,39 @@
+"""
+Embedding Cache
+- Wraps an embeddings model with an on-disk cache keyed by content hash
+- Only cache misses are sent to the underlying model
+- Keys include the model name, so switching models never returns stale vectors
+"""
+import hashlib
+from typing import List
+
+from diskcache import Cache
+from langchain_core.embeddings import Embeddings
+
+
+class CachedEmbeddings(Embeddings):
+    def __init__(self, inner: Embeddings, model: str, cache_dir: str):
+        self.inner = inner
+        self.model = model
+        self.cache = Cache(cache_dir)
+
+    def _key(self, text: str) -> bytes:
+        return hashlib.sha256(f"{self.model}\0{text}".encode()).digest()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(t) for t in texts]
+        vectors = [self.cache.get(key) for key in keys]
+
+        # Deduplicate misses so repeated texts in one call are embedded once.
+        misses = {keys[i]: texts[i] for i, v in enumerate(vectors) if v is None}
+        if misses:
+            fresh = self.inner.embed_documents(list(misses.values()))
+            computed = dict(zip(misses, fresh))
+            for key, vector in computed.items():
+                self.cache.set(key, vector)
+            vectors = [v if v is not None else computed[k] for k, v in zip(keys, vectors)]
+
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.inner.embed_query(text)
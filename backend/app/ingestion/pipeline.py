@@ -1,33 +1,38 @@
 """
 Ingestion Pipeline
-- Loads PDF / DOCX / TXT files
-- Splits into semantic chunks with overlap
+- Loads PDF (as per-page Markdown) / DOCX / TXT files
+- Splits PDFs on Markdown headings, then into chunks with overlap
 - Embeds with Google Generative AI embeddings
 - Stores in ChromaDB
 """
-import uuid
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache
 from pathlib import Path
 from typing import List
 
+import pymupdf4llm
 from langchain.schema import Document
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import Docx2txtLoader, PyPDFLoader, TextLoader
+from langchain.text_splitter import MarkdownHeaderTextSplitter, RecursiveCharacterTextSplitter
+from langchain_community.document_loaders import Docx2txtLoader, TextLoader
 from langchain_chroma import Chroma
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from langchain_google_genai._common import GoogleGenerativeAIError
 from chromadb.config import Settings as ChromaSettings
 
 from app.core.config import get_settings
+from app.ingestion.embedding_cache import CachedEmbeddings
+from app.retrieval.bm25_tokens import add_texts
 
 settings = get_settings()
 
 
 @lru_cache()
-def get_embeddings() -> GoogleGenerativeAIEmbeddings:
+def get_embeddings() -> CachedEmbeddings:
     """
     Build embeddings with a compatibility fallback for free-tier Gemini keys.
     Some keys do not support text-embedding-004 on the v1beta embed endpoint.
+    Document embeddings are cached on disk by content hash.
     """
     candidates = [
         settings.EMBEDDING_MODEL,
@@ -44,7 +49,10 @@ def get_embeddings() -> GoogleGenerativeAIEmbeddings:
         )
         try:
             emb.embed_query("healthcheck")
-            return emb
+            cache_dir = settings.EMBEDDING_CACHE_DIR or str(
+                Path(settings.CHROMA_PERSIST_DIR) / "emb_cache"
+            )
+            return CachedEmbeddings(emb, model_name, cache_dir)
         except GoogleGenerativeAIError as e:
             msg = str(e).lower()
             model_unavailable = (
@@ -73,10 +81,32 @@ def get_vector_store() -> Chroma:
     )
 
 
+# Heading levels that start a new section, and the metadata key each one gets.
+HEADERS_TO_SPLIT_ON = [("#", "h1"), ("##", "h2"), ("###", "h3")]
+
+
+def _load_pdf(file_path: str) -> List[Document]:
+    """
+    One Markdown document per page, keeping headings as # markers. Blank pages
+    are kept, as PyPDFLoader did, so total_pages counts them; they yield no chunks.
+    """
+    pages = pymupdf4llm.to_markdown(file_path, page_chunks=True, show_progress=False)
+    return [
+        Document(
+            page_content=page["text"],
+            # pymupdf4llm pages are 1-based; keep PyPDFLoader's 0-based numbering
+            metadata={"page": page["metadata"]["page"] - 1, "format": "markdown"},
+        )
+        for page in pages
+    ]
+
+
 def load_document(file_path: str) -> List[Document]:
     ext = Path(file_path).suffix.lower()
+    if ext == ".pdf":
+        return _load_pdf(file_path)
+
     loaders = {
-        ".pdf": PyPDFLoader,
         ".docx": Docx2txtLoader,
         ".txt": TextLoader,
     }
@@ -86,21 +116,112 @@ def load_document(file_path: str) -> List[Document]:
     return loader_cls(file_path).load()
 
 
+def _markdown_sections(
+    header_splitter: MarkdownHeaderTextSplitter, text: str
+) -> List[Document]:
+    """
+    Group the header splitter's paragraph-level output into sections, joined
+    with blank lines. The splitter's own aggregation joins paragraphs with
+    "  \n", which would leave the chunker no "\n\n" boundaries to split on.
+    A heading-only block is folded into the section under it, as the
+    splitter does.
+    """
+    sections: List[Document] = []
+    for block in header_splitter.split_text(text):
+        if sections:
+            last = sections[-1]
+            heading_only = all(
+                line.lstrip().startswith("#")
+                for line in last.page_content.splitlines() if line.strip()
+            )
+            nested = last.metadata.items() <= block.metadata.items()
+            if last.metadata == block.metadata or (heading_only and nested):
+                last.page_content += "\n\n" + block.page_content
+                last.metadata = block.metadata
+                continue
+        sections.append(Document(page_content=block.page_content, metadata=block.metadata))
+    return sections
+
+
+def _split_sections(docs: List[Document]) -> List[Document]:
+    """
+    Split Markdown documents at headings, recording the heading path of each
+    section. Pages of the same source are read in order, so headings carry
+    over page breaks. Other documents pass through unchanged.
+    """
+    header_splitter = MarkdownHeaderTextSplitter(
+        headers_to_split_on=HEADERS_TO_SPLIT_ON,
+        return_each_line=True,
+        strip_headers=False,
+    )
+    levels = [key for _, key in HEADERS_TO_SPLIT_ON]
+    sections = []
+    carried: dict = {}      # headings open at the end of the previous section
+    carried_source = None
+    for doc in docs:
+        if doc.metadata.get("format") != "markdown":
+            sections.append(doc)
+            continue
+        if doc.metadata.get("source") != carried_source:
+            carried, carried_source = {}, doc.metadata.get("source")
+
+        for section in _markdown_sections(header_splitter, doc.page_content):
+            # Headings seen on this page replace their level and everything
+            # below it; levels above the shallowest one come from earlier pages.
+            own = section.metadata
+            shallowest = min((levels.index(key) for key in own), default=len(levels))
+            headings = {key: carried[key] for key in levels[:shallowest] if key in carried}
+            headings.update(own)
+            carried = headings
+
+            path = [headings[key] for key in levels if key in headings]
+            sections.append(Document(
+                page_content=section.page_content,
+                metadata={**doc.metadata, "heading_path": " > ".join(path)},
+            ))
+    return sections
+
+
 def chunk_documents(docs: List[Document]) -> List[Document]:
     splitter = RecursiveCharacterTextSplitter(
         chunk_size=settings.CHUNK_SIZE,
         chunk_overlap=settings.CHUNK_OVERLAP,
         separators=["\n\n", "\n", ".", " ", ""],
     )
-    chunks = splitter.split_documents(docs)
+    # Sections that already fit in CHUNK_SIZE are kept whole
+    chunks = splitter.split_documents(_split_sections(docs))
 
+    # Content-derived ids make re-ingesting the same file an upsert, not a duplicate.
     for i, chunk in enumerate(chunks):
-        chunk.metadata["chunk_id"] = str(uuid.uuid4())
+        key = f"{chunk.metadata.get('source', '')}|{chunk.metadata.get('page', '')}|{i}|{chunk.page_content}"
+        chunk.metadata["chunk_id"] = hashlib.sha256(key.encode()).hexdigest()
         chunk.metadata["chunk_index"] = i
 
     return chunks
 
 
+def _add_chunks(vector_store: Chroma, chunks: List[Document]) -> None:
+    """
+    Embed chunks in batches of EMBED_BATCH_SIZE, with several batches in
+    flight at once, and upsert each batch into the collection as it completes.
+    """
+    batch_size = settings.EMBED_BATCH_SIZE
+    batches = [chunks[i : i + batch_size] for i in range(0, len(chunks), batch_size)]
+    embeddings = get_embeddings()
+
+    def embed(batch: List[Document]) -> List[List[float]]:
+        return embeddings.embed_documents([c.page_content for c in batch])
+
+    with ThreadPoolExecutor(max_workers=settings.EMBED_CONCURRENCY) as pool:
+        for batch, vectors in zip(batches, pool.map(embed, batches)):
+            vector_store._collection.upsert(
+                ids=[c.metadata["chunk_id"] for c in batch],
+                embeddings=vectors,
+                documents=[c.page_content for c in batch],
+                metadatas=[c.metadata for c in batch],
+            )
+
+
 def ingest_file(file_path: str, filename: str) -> dict:
     """
     Full pipeline: load -> chunk -> embed -> store.
@@ -115,7 +236,13 @@ def ingest_file(file_path: str, filename: str) -> dict:
     chunks = chunk_documents(docs)
 
     vector_store = get_vector_store()
-    vector_store.add_documents(chunks)
+    _add_chunks(vector_store, chunks)
+    # Re-ingested chunks keep their ids, so they are neither re-tokenized nor re-stored
+    add_texts({c.metadata["chunk_id"]: c.page_content for c in chunks})
+
+    # Imported here: the retriever module imports this one at load time.
+    from app.retrieval.hybrid_retriever import invalidate_index
+    invalidate_index()
 
     return {
         "filename": filename,
@@ -3,24 +3,34 @@ FastAPI Application
 Routes:
   POST /upload          — ingest a document
   POST /chat            — ask a question
+  POST /chat/stream     — ask a question, answer streamed as Server-Sent Events
   DELETE /chat/session  — clear session memory
   GET  /sources         — list ingested documents
   POST /evaluate        — run RAGAS evaluation
 """
+import asyncio
+import json
+import logging
 import os
 import uuid
-import shutil
 from typing import List
 
+import aiofiles
 from fastapi import FastAPI, UploadFile, File, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
 from app.core.config import get_settings
-from app.ingestion.pipeline import ingest_file, list_ingested_sources
-from app.chains.rag_chain import query_rag, clear_memory
+from app.ingestion.pipeline import (
+    get_vector_store,
+    ingest_file,
+    list_ingested_sources,
+)
+from app.chains.rag_chain import get_llm, query_rag, stream_rag, clear_memory
 
 settings = get_settings()
+logger = logging.getLogger(__name__)
 
 app = FastAPI(
     title="EnterpriseRAG API",
@@ -44,6 +54,7 @@ app.add_middleware(
 )
 
 UPLOAD_DIR = "/tmp/rag_uploads"
+UPLOAD_CHUNK_SIZE = 1 << 20
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 
@@ -63,6 +74,27 @@ class EvalRequest(BaseModel):
     test_cases: List[dict]   # [{"question": ..., "ground_truth": ...}]
 
 
+# ── Startup ───────────────────────────────────────────────────────────────────
+
+@app.on_event("startup")
+async def warm_up():
+    """
+    Resolve the chat model, embeddings and vector store before serving, so the
+    first /chat request doesn't pay for the model probe round trips.
+    get_vector_store resolves the embeddings itself; warming both in parallel
+    would race the lru_cache and probe (and build) the embeddings twice.
+    Failures are logged, not raised: the cached getters retry on first use.
+    """
+    results = await asyncio.gather(
+        asyncio.to_thread(get_llm),
+        asyncio.to_thread(get_vector_store),
+        return_exceptions=True,
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            logger.warning("Startup warm-up failed: %s", result)
+
+
 # ── Routes ────────────────────────────────────────────────────────────────────
 
 @app.get("/health")
@@ -78,15 +110,18 @@ async def upload_document(file: UploadFile = File(...)):
     if ext not in allowed:
         raise HTTPException(400, f"Unsupported file type: {ext}. Use PDF, DOCX, or TXT.")
 
-    # Save temporarily
+    # Save temporarily, streaming in 1 MiB chunks without blocking the event loop
     tmp_path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4()}{ext}")
-    with open(tmp_path, "wb") as f:
-        shutil.copyfileobj(file.file, f)
-
     try:
-        result = ingest_file(tmp_path, file.filename)
+        async with aiofiles.open(tmp_path, "wb") as f:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                await f.write(chunk)
+
+        # Parsing and embedding are blocking; run them off the event loop
+        result = await asyncio.to_thread(ingest_file, tmp_path, file.filename)
     finally:
-        os.remove(tmp_path)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
     return result
 
@@ -107,6 +142,34 @@ def chat(req: ChatRequest):
     return ChatResponse(**result)
 
 
+@app.post("/chat/stream")
+def chat_stream(req: ChatRequest):
+    """
+    Ask a question and receive the answer as Server-Sent Events:
+    {"delta": ...} per generated chunk, then {"sources": ..., "session_id": ...}.
+    Failures before generation starts return 500, as /chat does; failures
+    while generating are sent as an {"error": ...} event.
+    """
+    if not req.question.strip():
+        raise HTTPException(400, "Question cannot be empty.")
+
+    session_id = req.session_id or str(uuid.uuid4())
+
+    try:
+        stream = stream_rag(req.question, session_id)
+    except Exception as e:
+        raise HTTPException(500, f"RAG chain error: {str(e)}")
+
+    def events():
+        try:
+            for event in stream:
+                yield f"data: {json.dumps(event)}\n\n"
+        except Exception as e:
+            yield f"data: {json.dumps({'error': f'RAG chain error: {str(e)}'})}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
 @app.delete("/chat/session/{session_id}")
 def clear_session(session_id: str):
     """Clear conversation memory for a session."""
@@ -0,0 +1,121 @@
+"""
+BM25 Token Store
+- Tokenizes chunk text for BM25
+- Persists tokens per chunk_id next to ChromaDB so restarts skip re-tokenizing
+- The file is a sequence of appended pickled {chunk_id: tokens} batches;
+  each chunk_id is stored once, and stale entries are compacted away
+"""
+import os
+import pickle
+import threading
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from app.core.config import get_settings
+
+settings = get_settings()
+
+TOKENS_FILE = "bm25_tokens.pkl"
+
+_tokens: Dict[str, List[str]] | None = None
+_file_entries = 0  # entries in the file, including duplicates and stale ids
+_lock = threading.Lock()
+
+
+def tokenize(text: str) -> List[str]:
+    return text.lower().split()
+
+
+def _path() -> Path:
+    return Path(settings.CHROMA_PERSIST_DIR) / TOKENS_FILE
+
+
+def _load() -> Tuple[Dict[str, List[str]], int]:
+    """Read every stored batch; returns (tokens, number of entries read)."""
+    tokens: Dict[str, List[str]] = {}
+    entries = 0
+    try:
+        with open(_path(), "rb") as f:
+            while True:
+                batch = pickle.load(f)
+                entries += len(batch)
+                tokens.update(batch)
+    except FileNotFoundError:
+        pass
+    except (EOFError, pickle.UnpicklingError):
+        # End of file, or a truncated trailing batch: keep what was read.
+        pass
+    return tokens, entries
+
+
+def _stored() -> Dict[str, List[str]]:
+    """The in-memory store, loaded on first use. Caller holds _lock."""
+    global _tokens, _file_entries
+    if _tokens is None:
+        _tokens, _file_entries = _load()
+    return _tokens
+
+
+def _append(tokens: Dict[str, List[str]]) -> None:
+    """Persist a batch of new chunk tokens. Caller holds _lock."""
+    global _file_entries
+    os.makedirs(settings.CHROMA_PERSIST_DIR, exist_ok=True)
+    with open(_path(), "ab") as f:
+        pickle.dump(tokens, f, protocol=pickle.HIGHEST_PROTOCOL)
+    _tokens.update(tokens)
+    _file_entries += len(tokens)
+
+
+def _rewrite(tokens: Dict[str, List[str]]) -> None:
+    """Replace the file with a single batch. Caller holds _lock."""
+    global _tokens, _file_entries
+    tmp_path = _path().with_suffix(".tmp")
+    with open(tmp_path, "wb") as f:
+        pickle.dump(tokens, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, _path())
+    _tokens, _file_entries = tokens, len(tokens)
+
+
+def add_tokens(tokens: Dict[str, List[str]]) -> None:
+    """Store tokens for the chunks that are not in the store yet."""
+    with _lock:
+        stored = _stored()
+        new = {chunk_id: t for chunk_id, t in tokens.items() if chunk_id not in stored}
+        if new:
+            _append(new)
+
+
+def add_texts(texts: Dict[str, str]) -> None:
+    """Tokenize and store {chunk_id: text}, skipping chunks already stored."""
+    with _lock:
+        stored = _stored()
+        new = {
+            chunk_id: tokenize(text)
+            for chunk_id, text in texts.items()
+            if chunk_id not in stored
+        }
+        if new:
+            _append(new)
+
+
+def get_tokens(ids: List[str], texts: List[str]) -> List[List[str]]:
+    """
+    Return tokens for each chunk of the collection, tokenizing (and
+    persisting) only the chunks that are not in the store yet. Tokens of
+    chunks no longer in the collection, and duplicate entries left by older
+    versions of the store, are compacted away.
+    """
+    with _lock:
+        stored = _stored()
+        missing = {
+            chunk_id: tokenize(text)
+            for chunk_id, text in zip(ids, texts)
+            if chunk_id not in stored
+        }
+        if missing:
+            _append(missing)
+
+        result = [stored[chunk_id] for chunk_id in ids]
+        if _file_entries > len(ids):
+            _rewrite({chunk_id: stored[chunk_id] for chunk_id in ids})
+        return result
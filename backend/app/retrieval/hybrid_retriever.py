@@ -5,78 +5,192 @@ Hybrid Retriever
 - Reciprocal Rank Fusion to merge results
 - Cross-encoder re-ranking for final top-K
 """
+import threading
 from typing import List, Tuple
+
+import bm25s
+import numpy as np
+from cachetools import TTLCache
 from langchain.schema import Document
-from rank_bm25 import BM25Okapi
 
 from app.core.config import get_settings
+from app.retrieval.bm25_tokens import get_tokens, tokenize
 from app.ingestion.pipeline import get_vector_store
 
 settings = get_settings()
 
+# Snapshot of the stored chunks plus their BM25 index, rebuilt only when the
+# collection changes. "version" is the collection size at build time; ingest
+# resets it via invalidate_index() so upserts that keep the size still rebuild.
+# Chunks are held column-wise (ids / texts / metas) and addressed by their
+# integer position, which fusion works on; only the final top-K hits are
+# materialized as Documents.
+_bm25_cache: dict = {
+    "version": None, "ids": None, "positions": {}, "texts": None, "metas": None,
+    "bm25": None,
+}
+_bm25_lock = threading.Lock()
+
+# Recent results keyed by normalized query text. Cleared on ingest; entries
+# also expire after RETRIEVAL_CACHE_TTL so other workers' ingests show up.
+_retrieval_cache: TTLCache = TTLCache(
+    maxsize=settings.RETRIEVAL_CACHE_SIZE, ttl=settings.RETRIEVAL_CACHE_TTL
+)
+_retrieval_lock = threading.Lock()
+
+
+def invalidate_index() -> None:
+    """Drop the cached BM25 index and query results so the next query rebuilds."""
+    global _bm25_cache
+    with _bm25_lock:
+        _bm25_cache = {**_bm25_cache, "version": None}
+    with _retrieval_lock:
+        _retrieval_cache.clear()
+
+
+def _build_bm25(tokenized_corpus: List[List[str]]) -> bm25s.BM25:
+    """Index pre-tokenized chunks as a sparse score matrix."""
+    bm25 = bm25s.BM25()
+    bm25.index(tokenized_corpus, show_progress=False)
+    return bm25
+
+
+def _get_bm25() -> dict:
+    """
+    Return the corpus snapshot {"ids", "positions", "texts", "metas", "bm25"}
+    ("positions" maps metadata chunk_id -> row), reading the collection and building
+    the index only when it has changed since the last build. The returned
+    dict is never mutated, so callers can use it unlocked.
+    """
+    global _bm25_cache
+    vector_store = get_vector_store()
+    version = vector_store._collection.count()
+
+    with _bm25_lock:
+        if _bm25_cache["version"] != version:
+            raw = vector_store.get(include=["documents", "metadatas"])
+            corpus_texts = raw["documents"]
+            tokenized_corpus = get_tokens(raw["ids"], corpus_texts)
+
+            _bm25_cache = {
+                "version": version,
+                "ids": np.array(raw["ids"], dtype=object),
+                # Keyed like dense hits, on metadata chunk_id. Collections
+                # ingested via add_documents have Chroma ids that differ from it.
+                "positions": {
+                    (meta or {}).get("chunk_id", chunk_id): i
+                    for i, (chunk_id, meta) in enumerate(zip(raw["ids"], raw["metadatas"]))
+                },
+                "texts": np.array(corpus_texts, dtype=object),
+                "metas": raw["metadatas"],
+                "bm25": _build_bm25(tokenized_corpus) if corpus_texts else None,
+            }
+
+        return _bm25_cache
+
 
 def _reciprocal_rank_fusion(
-    ranked_lists: List[List[Document]], k: int = 60
-) -> List[Tuple[Document, float]]:
+    ranked_lists: List[np.ndarray], k: int = 60
+) -> Tuple[np.ndarray, np.ndarray]:
     """
-    Merge multiple ranked lists using Reciprocal Rank Fusion.
+    Merge ranked lists of integer chunk positions using Reciprocal Rank Fusion.
+    Returns (positions, scores), best first; ties keep first-seen order.
     Higher score = better. k=60 is the standard constant.
     """
-    scores: dict[str, float] = {}
-    doc_map: dict[str, Document] = {}
+    positions = np.concatenate([np.asarray(r, dtype=np.int64) for r in ranked_lists])
+    contributions = np.concatenate(
+        [1.0 / (k + np.arange(len(r)) + 1) for r in ranked_lists]
+    )
+
+    unique, first_seen, inverse = np.unique(
+        positions, return_index=True, return_inverse=True
+    )
+    scores = np.bincount(inverse, weights=contributions, minlength=len(unique))
+    order = np.lexsort((first_seen, -scores))
+    return unique[order], scores[order]
+
 
-    for ranked in ranked_lists:
-        for rank, doc in enumerate(ranked):
-            doc_id = doc.metadata.get("chunk_id", doc.page_content[:80])
-            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
-            doc_map[doc_id] = doc
+def _bm25_topk(query: str) -> Tuple[dict, np.ndarray]:
+    """
+    BM25 sparse retrieval over the cached index.
+    Returns the snapshot used and the ranked corpus positions of the top-K.
+    """
+    snapshot = _get_bm25()
+    bm25 = snapshot["bm25"]
+    query_tokens = tokenize(query)
+    if bm25 is None or not query_tokens:
+        return snapshot, np.empty(0, dtype=np.int64)
 
-    sorted_ids = sorted(scores, key=lambda x: scores[x], reverse=True)
-    return [(doc_map[doc_id], scores[doc_id]) for doc_id in sorted_ids]
+    # bm25s returns the top-K corpus indices already ranked
+    k = min(settings.TOP_K_SPARSE, len(snapshot["texts"]))
+    results, _ = bm25.retrieve([query_tokens], k=k, show_progress=False)
+    return snapshot, results[0]
 
 
 def hybrid_retrieve(query: str, all_docs: List[Document] | None = None) -> List[Document]:
     """
-    1. Dense retrieval from ChromaDB
-    2. BM25 sparse retrieval over stored chunks
+    0. Return recent results for the same (normalized) query
+    1. Dense retrieval from ChromaDB; return it as-is if the best hit is
+       already confident
+    2. BM25 sparse retrieval over stored chunks (cached index)
     3. RRF merge
     4. Return top-K
     """
+    key = " ".join(query.lower().split())
+    with _retrieval_lock:
+        cached = _retrieval_cache.get(key)
+    if cached is not None:
+        return list(cached)
+
+    top_docs = _retrieve(query)
+
+    with _retrieval_lock:
+        _retrieval_cache[key] = top_docs
+    return list(top_docs)
+
+
+def _retrieve(query: str) -> List[Document]:
     vector_store = get_vector_store()
 
     # ── Dense retrieval ───────────────────────────────────────────────────────
-    dense_results = vector_store.similarity_search(
+    dense_with_scores = vector_store.similarity_search_with_score(
         query, k=settings.TOP_K_DENSE
     )
+    dense_results = [doc for doc, _ in dense_with_scores]
+
+    # ── Early exit on a confident dense hit ───────────────────────────────────
+    # Scores are distances (lower = closer); skip BM25 and fusion entirely.
+    if dense_with_scores and dense_with_scores[0][1] < settings.DENSE_CONF_THRESHOLD:
+        return dense_results[: settings.TOP_K_FINAL]
 
     # ── Sparse retrieval (BM25) ───────────────────────────────────────────────
-    # Fetch all stored chunks for BM25 indexing
-    raw = vector_store.get(include=["documents", "metadatas"])
-    corpus_texts = raw["documents"]
-    corpus_metas = raw["metadatas"]
-
-    if corpus_texts:
-        tokenized_corpus = [doc.lower().split() for doc in corpus_texts]
-        bm25 = BM25Okapi(tokenized_corpus)
-        bm25_scores = bm25.get_scores(query.lower().split())
-
-        # Get top-K sparse indices
-        top_sparse_idx = sorted(
-            range(len(bm25_scores)), key=lambda i: bm25_scores[i], reverse=True
-        )[: settings.TOP_K_SPARSE]
-
-        sparse_results = [
-            Document(
-                page_content=corpus_texts[i],
-                metadata=corpus_metas[i],
-            )
-            for i in top_sparse_idx
-        ]
-    else:
-        sparse_results = []
+    # Runs after the gate so confident queries never touch the index; with the
+    # index cached this costs milliseconds, so overlapping it with the dense
+    # search would save next to nothing.
+    snapshot, sparse_idx = _bm25_topk(query)
+
+    # ── Map dense hits to corpus positions ────────────────────────────────────
+    # Chunks newer than the BM25 snapshot get a slot past the end of the corpus.
+    corpus_size = len(snapshot["texts"])
+    docs_by_pos: dict[int, Document] = {}
+    dense_idx = []
+    for doc in dense_results:
+        pos = snapshot["positions"].get(doc.metadata.get("chunk_id"), -1)
+        if pos < 0:
+            pos = corpus_size + len(dense_idx)
+        docs_by_pos[pos] = doc
+        dense_idx.append(pos)
 
     # ── Fuse + deduplicate ────────────────────────────────────────────────────
-    fused = _reciprocal_rank_fusion([dense_results, sparse_results])
-    top_docs = [doc for doc, _ in fused[: settings.TOP_K_FINAL]]
+    fused, _ = _reciprocal_rank_fusion([dense_idx, sparse_idx])
+
+    top_docs = []
+    for pos in fused[: settings.TOP_K_FINAL]:
+        doc = docs_by_pos.get(pos)
+        if doc is None:
+            doc = Document(
+                page_content=snapshot["texts"][pos], metadata=snapshot["metas"][pos]
+            )
+        top_docs.append(doc)
 
     return top_docs
@@ -33,6 +33,203 @@ def test_chunk_assigns_unique_ids():
     assert len(ids) == len(set(ids)), "chunk_ids must be unique"
 
 
+def test_embedding_cache_only_embeds_misses(tmp_path):
+    from app.ingestion.embedding_cache import CachedEmbeddings
+    inner = MagicMock()
+    inner.embed_documents.side_effect = lambda texts: [[float(len(t))] for t in texts]
+    emb = CachedEmbeddings(inner, "test-model", str(tmp_path))
+
+    assert emb.embed_documents(["a", "bb"]) == [[1.0], [2.0]]
+    assert emb.embed_documents(["bb", "ccc", "ccc"]) == [[2.0], [3.0], [3.0]]
+    inner.embed_documents.assert_called_with(["ccc"])
+
+
+def test_markdown_chunks_carry_heading_path():
+    text = "# Leave Policy\n\n## Remote Work\n\nUp to 90 days abroad.\n\n## Sick Leave\n\nTen days."
+    docs = [Document(page_content=text, metadata={"source": "hr.pdf", "page": 0, "format": "markdown"})]
+    chunks = chunk_documents(docs)
+    paths = {c.page_content.split()[-1]: c.metadata["heading_path"] for c in chunks}
+    assert paths["abroad."] == "Leave Policy > Remote Work"
+    assert paths["days."] == "Leave Policy > Sick Leave"
+    assert all(c.metadata["page"] == 0 for c in chunks)
+
+
+def test_markdown_sections_keep_paragraph_breaks():
+    paragraph = "Lorem ipsum dolor sit amet. " * 15
+    text = "# Handbook\n\n## Remote Work\n\n" + "\n\n".join([paragraph] * 4)
+    docs = [Document(page_content=text, metadata={"source": "hr.pdf", "page": 0, "format": "markdown"})]
+    chunks = chunk_documents(docs)
+    assert len(chunks) > 1
+    # Chunks are cut at paragraph boundaries, not mid-paragraph.
+    for chunk in chunks:
+        body = chunk.page_content.split("## Remote Work")[-1].strip()
+        assert all(p.strip() == paragraph.strip() for p in body.split("\n\n"))
+        assert chunk.metadata["heading_path"] == "Handbook > Remote Work"
+
+
+def test_heading_path_carries_across_pages():
+    pages = [
+        "# Leave Policy\n\n## Remote Work\n\nUp to 90 days abroad.",
+        "Manager approval is required.\n\n## Sick Leave\n\nTen days.",
+    ]
+    docs = [
+        Document(page_content=text, metadata={"source": "hr.pdf", "page": i, "format": "markdown"})
+        for i, text in enumerate(pages)
+    ]
+    chunks = chunk_documents(docs)
+    paths = {c.page_content.split()[-1]: c.metadata["heading_path"] for c in chunks}
+    assert paths["required."] == "Leave Policy > Remote Work"
+    assert paths["days."] == "Leave Policy > Sick Leave"
+
+
+def test_chunk_ids_are_deterministic():
+    def make_docs():
+        return [Document(page_content="Content " * 300, metadata={"source": "a.pdf", "page": 0})]
+    first = [c.metadata["chunk_id"] for c in chunk_documents(make_docs())]
+    second = [c.metadata["chunk_id"] for c in chunk_documents(make_docs())]
+    assert first == second
+
+
+def test_reingesting_chunks_leaves_token_store_unchanged(tmp_path, monkeypatch):
+    from app.retrieval import bm25_tokens as bt
+    monkeypatch.setattr(bt.settings, "CHROMA_PERSIST_DIR", str(tmp_path))
+    monkeypatch.setattr(bt, "_tokens", None)
+
+    def make_chunks():
+        docs = [Document(page_content="Content " * 300, metadata={"source": "a.pdf", "page": 0})]
+        return {c.metadata["chunk_id"]: c.page_content for c in chunk_documents(docs)}
+
+    bt.add_texts(make_chunks())
+    size = (tmp_path / bt.TOKENS_FILE).stat().st_size
+    bt.add_texts(make_chunks())
+    assert (tmp_path / bt.TOKENS_FILE).stat().st_size == size
+
+
+# ── Retrieval tests ───────────────────────────────────────────────────────────
+def test_bm25_index_reused_until_invalidated():
+    from app.retrieval import hybrid_retriever as hr
+    store = MagicMock()
+    store._collection.count.return_value = 2
+    store.get.return_value = {
+        "ids": ["1", "2"],
+        "documents": ["alpha beta", "gamma delta"],
+        "metadatas": [{"source": "a.pdf"}, {"source": "b.pdf"}],
+    }
+    with patch.object(hr, "get_vector_store", return_value=store), \
+            patch.object(hr, "get_tokens", lambda ids, texts: [t.split() for t in texts]):
+        hr.invalidate_index()
+        hr._get_bm25()
+        hr._get_bm25()
+        assert store.get.call_count == 1
+        hr.invalidate_index()
+        hr._get_bm25()
+        assert store.get.call_count == 2
+
+
+def test_reciprocal_rank_fusion_sums_ranks():
+    import numpy as np
+    from app.retrieval.hybrid_retriever import _reciprocal_rank_fusion
+    positions, scores = _reciprocal_rank_fusion([[3, 1, 2], np.array([2, 3])])
+    assert positions.tolist() == [3, 2, 1]
+    assert scores[0] == pytest.approx(1 / 61 + 1 / 62)
+    assert scores[1] == pytest.approx(1 / 63 + 1 / 61)
+
+
+def test_confident_dense_hit_skips_fusion():
+    import numpy as np
+    from app.retrieval import hybrid_retriever as hr
+    dense = [Document(page_content=f"d{i}", metadata={"chunk_id": f"d{i}"}) for i in range(5)]
+    snapshot = {
+        "positions": {"s0": 0},
+        "texts": np.array(["s0"], dtype=object),
+        "metas": [{"chunk_id": "s0"}],
+    }
+    store = MagicMock()
+    store.similarity_search_with_score.return_value = [(d, 0.01) for d in dense]
+    with patch.object(hr, "get_vector_store", return_value=store), \
+            patch.object(hr, "_bm25_topk", return_value=(snapshot, np.array([0]))) as bm25:
+        hr.invalidate_index()
+        assert hr.hybrid_retrieve("q") == dense[: hr.settings.TOP_K_FINAL]
+        bm25.assert_not_called()
+
+        store.similarity_search_with_score.return_value = [(d, 1.5) for d in dense]
+        hr.invalidate_index()
+        fused = hr.hybrid_retrieve("q")
+        assert [d.page_content for d in fused[:2]] == ["d0", "s0"]
+
+
+def test_fusion_merges_hits_when_chroma_ids_differ_from_chunk_ids():
+    import numpy as np
+    from app.retrieval import hybrid_retriever as hr
+    # Legacy collections: Chroma generated its own ids, chunk_id lives in metadata.
+    metas = [{"chunk_id": "c0"}, {"chunk_id": "c1"}]
+    store = MagicMock()
+    store._collection.count.return_value = 2
+    store.get.return_value = {
+        "ids": ["uuid-0", "uuid-1"],
+        "documents": ["leave policy remote work", "sick leave ten days"],
+        "metadatas": metas,
+    }
+    store.similarity_search_with_score.return_value = [
+        (Document(page_content=text, metadata=meta), 1.5)
+        for text, meta in zip(store.get.return_value["documents"], metas)
+    ]
+    with patch.object(hr, "get_vector_store", return_value=store), \
+            patch.object(hr, "get_tokens", lambda ids, texts: [t.split() for t in texts]):
+        hr.invalidate_index()
+        snapshot = hr._get_bm25()
+        with patch.object(hr, "_bm25_topk", return_value=(snapshot, np.array([0, 1]))):
+            results = hr.hybrid_retrieve("leave policy")
+    assert [d.page_content for d in results] == [
+        "leave policy remote work",
+        "sick leave ten days",
+    ]
+
+
+def test_repeated_query_served_from_cache():
+    from app.retrieval import hybrid_retriever as hr
+    doc = Document(page_content="d0", metadata={"chunk_id": "d0"})
+    store = MagicMock()
+    store.similarity_search_with_score.return_value = [(doc, 0.01)]
+    with patch.object(hr, "get_vector_store", return_value=store), \
+            patch.object(hr, "_bm25_topk"):
+        hr.invalidate_index()
+        assert hr.hybrid_retrieve("What is the leave policy?") == [doc]
+        assert hr.hybrid_retrieve("  what is the LEAVE policy? ") == [doc]
+        assert store.similarity_search_with_score.call_count == 1
+
+
+def test_bm25_tokens_persist_across_restarts(tmp_path, monkeypatch):
+    from app.retrieval import bm25_tokens as bt
+    monkeypatch.setattr(bt.settings, "CHROMA_PERSIST_DIR", str(tmp_path))
+    monkeypatch.setattr(bt, "_tokens", None)
+    bt.add_tokens({"1": ["alpha", "beta"]})
+    assert bt.get_tokens(["1", "2"], ["ignored", "Gamma Delta"]) == [
+        ["alpha", "beta"],
+        ["gamma", "delta"],
+    ]
+
+    monkeypatch.setattr(bt, "_tokens", None)  # simulate a fresh process
+    assert bt.get_tokens(["2"], ["ignored"]) == [["gamma", "delta"]]
+
+
+def test_bm25_tokens_store_each_chunk_once(tmp_path, monkeypatch):
+    from app.retrieval import bm25_tokens as bt
+    monkeypatch.setattr(bt.settings, "CHROMA_PERSIST_DIR", str(tmp_path))
+    monkeypatch.setattr(bt, "_tokens", None)
+    batch = {"1": ["alpha"], "2": ["beta"]}
+    bt.add_tokens(batch)
+    size = (tmp_path / bt.TOKENS_FILE).stat().st_size
+    bt.add_tokens(batch)
+    bt.add_tokens(batch)
+    assert (tmp_path / bt.TOKENS_FILE).stat().st_size == size
+
+    # Chunk "2" left the collection: the file is compacted to live chunks.
+    assert bt.get_tokens(["1"], ["ignored"]) == [["alpha"]]
+    monkeypatch.setattr(bt, "_tokens", None)
+    assert bt._load() == ({"1": ["alpha"]}, 1)
+
+
 # ── RAG chain tests ───────────────────────────────────────────────────────────
 def test_memory_is_per_session():
     from app.chains.rag_chain import get_memory, clear_memory
@@ -49,6 +246,67 @@ def test_clear_memory():
     assert "to_clear" not in _session_memories
 
 
+def test_memory_keeps_last_turns_only():
+    from langchain.schema import AIMessage, HumanMessage
+    from app.chains.rag_chain import get_memory, clear_memory, settings
+    clear_memory("window")
+    memory = get_memory("window")
+    for i in range(settings.MEMORY_TURNS + 2):
+        memory.append(HumanMessage(content=f"q{i}"))
+        memory.append(AIMessage(content=f"a{i}"))
+    assert len(memory) == 2 * settings.MEMORY_TURNS
+    assert memory[0].content == "q2"
+
+
+def test_least_recently_used_session_is_evicted(monkeypatch):
+    from cachetools import LRUCache
+    from app.chains import rag_chain
+    monkeypatch.setattr(rag_chain, "_session_memories", LRUCache(maxsize=2))
+    rag_chain.get_memory("old")
+    rag_chain.get_memory("recent")
+    rag_chain.get_memory("old")
+    rag_chain.get_memory("new")
+    assert "recent" not in rag_chain._session_memories
+    assert "old" in rag_chain._session_memories
+
+
+def test_format_sources_dedupes_by_source_and_page():
+    from app.chains.rag_chain import format_sources
+    docs = [
+        Document(page_content="a", metadata={"source": "x.pdf", "page": 1}),
+        Document(page_content="b", metadata={"source": "x.pdf", "page": 1}),
+        Document(page_content="c", metadata={"source": "x.pdf", "page": 2}),
+        Document(page_content="d", metadata={}),
+    ]
+    assert format_sources(docs) == [
+        {"filename": "x.pdf", "page": 1},
+        {"filename": "x.pdf", "page": 2},
+        {"filename": "unknown", "page": "?"},
+    ]
+
+
+def test_format_context_caps_each_chunk():
+    from app.chains.rag_chain import format_context, settings
+    docs = [
+        Document(page_content="x" * 5000, metadata={"source": "a.pdf", "page": 2}),
+        Document(page_content="short", metadata={}),
+    ]
+    first, second = format_context(docs).split("\n\n---\n\n")
+    assert first == "[Source: a.pdf | Page: 2]\n" + "x" * settings.MAX_CONTEXT_CHARS_PER_DOC
+    assert second == "[Source: unknown | Page: ?]\nshort"
+
+
+def test_query_rag_contexts_match_prompt_cap():
+    from app.chains import rag_chain
+    doc = Document(page_content="x" * 5000, metadata={"source": "a.pdf", "page": 0})
+    llm = MagicMock()
+    llm.invoke.return_value = MagicMock(content="answer")
+    with patch.object(rag_chain, "get_llm", return_value=llm), \
+            patch.object(rag_chain, "hybrid_retrieve", return_value=[doc]):
+        result = rag_chain.query_rag("q", "contexts", include_contexts=True)
+    assert result["contexts"] == ["x" * rag_chain.settings.MAX_CONTEXT_CHARS_PER_DOC]
+
+
 # ── API tests ─────────────────────────────────────────────────────────────────
 def test_health_endpoint():
     from fastapi.testclient import TestClient
@@ -67,6 +325,43 @@ def test_chat_empty_question():
     assert resp.status_code == 400
 
 
+def test_chat_stream_empty_question():
+    from fastapi.testclient import TestClient
+    from app.main import app
+    client = TestClient(app)
+    resp = client.post("/chat/stream", json={"question": "  ", "session_id": "test"})
+    assert resp.status_code == 400
+
+
+def test_chat_stream_retrieval_error_returns_500():
+    from fastapi.testclient import TestClient
+    from app.chains import rag_chain
+    from app.main import app
+    client = TestClient(app)
+    with patch.object(rag_chain, "get_llm", return_value=MagicMock()), \
+            patch.object(rag_chain, "hybrid_retrieve", side_effect=RuntimeError("chroma down")):
+        resp = client.post("/chat/stream", json={"question": "hi", "session_id": "test"})
+    assert resp.status_code == 500
+    assert "chroma down" in resp.json()["detail"]
+
+
+def test_stream_rag_emits_deltas_then_sources():
+    from app.chains import rag_chain
+    doc = Document(page_content="ctx", metadata={"source": "a.pdf", "page": 1})
+    llm = MagicMock()
+    llm.stream.return_value = [MagicMock(content="Hel"), MagicMock(content="lo")]
+    with patch.object(rag_chain, "get_llm", return_value=llm), \
+            patch.object(rag_chain, "hybrid_retrieve", return_value=[doc]):
+        rag_chain.clear_memory("stream")
+        events = list(rag_chain.stream_rag("hi", "stream"))
+    assert events == [
+        {"delta": "Hel"},
+        {"delta": "lo"},
+        {"sources": [{"filename": "a.pdf", "page": 1}], "session_id": "stream"},
+    ]
+    assert rag_chain.get_memory("stream")[-1].content == "Hello"
+
+
 def test_upload_invalid_extension():
     from fastapi.testclient import TestClient
     from app.main import app